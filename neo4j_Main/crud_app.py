@@ -1,150 +1,355 @@
+import asyncio
+import json
+import logging
+import logging.handlers
 import os
+import queue
+import random
 import sys
+import threading
 import time
-from neo4j import GraphDatabase
-from neo4j.exceptions import ServiceUnavailable
+from dataclasses import dataclass
+from neo4j import AsyncGraphDatabase
+from neo4j.exceptions import ServiceUnavailable, SessionExpired, TransientError
 
 # --- Configuration ---
 URI = os.getenv("NEO4J_URI", "bolt://localhost:7687")
 USER = os.getenv("NEO4J_USER", "neo4j")
 PASSWORD = os.getenv("NEO4J_PASSWORD", "secretpassword")
+# Always target an explicit database; leaving it unset makes the driver look up the server's default first.
 DATABASE = os.getenv("NEO4J_DATABASE", "projectdb")
+POOL_SIZE = int(os.getenv("NEO4J_POOL_SIZE", "100"))
+ACQ_TIMEOUT = float(os.getenv("NEO4J_ACQ_TIMEOUT", "60"))
+MAX_CONN_LIFETIME = 1800
+BREAKER_THRESHOLD = int(os.getenv("NEO4J_BREAKER_THRESHOLD", "5"))
+BREAKER_COOLDOWN = float(os.getenv("NEO4J_BREAKER_COOLDOWN", "30"))
+# Optional JSON file {"tasks": [{id, name}, ...], "assignments": [{person_name, role, task_id}, ...]};
+# without it the single example task below is used.
+TASKS_FILE = os.getenv("NEO4J_TASKS_FILE")
+# Tasks per write transaction; each batch is written with one UNWIND query per step.
+BATCH_SIZE = int(os.getenv("NEO4J_BATCH_SIZE", "1000"))
+
+# --- Example Data ---
+# Passed to Cypher as parameters so each query keeps one plan-cache entry whatever the values are.
+TASK_ID = "T1"
+TASK_NAME = "Distributed Systems Project Setup"
+TASK_STATUS = "In Progress"
+PERSON_NAME = "Jane Doe"
+PERSON_ROLE = "Team Lead"
+TASKS = [{"id": TASK_ID, "name": TASK_NAME}]
+ASSIGNMENTS = [{"person_name": PERSON_NAME, "role": PERSON_ROLE, "task_id": TASK_ID}]
+
+# --- Cypher Queries ---
+# Defined once at module level; every query takes its values as parameters.
+_Q_PING = "RETURN 1"
+_Q_CONSTRAINT_TASK_ID = "CREATE CONSTRAINT task_id IF NOT EXISTS FOR (n:Task) REQUIRE n.id IS UNIQUE"
+_Q_CONSTRAINT_PERSON_NAME = "CREATE CONSTRAINT person_name IF NOT EXISTS FOR (p:Person) REQUIRE p.name IS UNIQUE"
+_Q_DELETE_TASKS = "UNWIND $task_ids AS id MATCH (n:Task {id: id}) DETACH DELETE n"
+_Q_DELETE_PERSONS = "UNWIND $person_names AS name MATCH (p:Person {name: name}) DETACH DELETE p"
+_Q_CREATE_TASKS = "UNWIND $tasks AS t CREATE (n:Task {id: t.id, name: t.name, status: 'New'})"
+_Q_READ_TASKS = "UNWIND $task_ids AS id MATCH (n:Task {id: id}) RETURN n.id AS id, n.name AS name, n.status AS status"
+_Q_UPDATE_TASKS = "UNWIND $task_ids AS id MATCH (n:Task {id: id}) SET n.status = $status, n.updatedAt = datetime()"
+_Q_MERGE_ASSIGNMENTS = """
+UNWIND $assignments AS a
+MERGE (p:Person {name: a.person_name})
+ON CREATE SET p.role = a.role
+WITH p, a
+MATCH (t:Task {id: a.task_id})
+MERGE (p)-[r:RESPONSIBLE_FOR]->(t)
+ON CREATE SET r.assigned_date = date()
+RETURN count(r) AS linked
+"""
+_Q_VERIFY_RELATIONSHIPS = """
+UNWIND $assignments AS a
+MATCH (p:Person {name: a.person_name})-[r:RESPONSIBLE_FOR]->(t:Task {id: a.task_id})
+RETURN p.name AS Responsible, t.name AS Task, type(r) AS Relationship
+"""
+
+# --- Logging ---
+logger = logging.getLogger(__name__)
+
+def setup_logging():
+    """Routes log records through a queue so a background QueueListener thread does the stdout writes."""
+    log_queue = queue.SimpleQueue()
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(message)s"))
+    listener = logging.handlers.QueueListener(log_queue, stream_handler)
+    logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    listener.start()
+    return listener
+
+# --- Shared Driver ---
+# One Driver (and therefore one Bolt connection pool) per (uri, user), reused for the whole process.
+_DRIVERS = {}
+_DRIVER_LOCK = threading.Lock()
+
+def get_driver(uri, auth):
+    """Returns the shared Driver for (uri, user), creating it on first use."""
+    key = (uri, auth[0])
+    with _DRIVER_LOCK:
+        driver = _DRIVERS.get(key)
+        if driver is None:
+            driver = AsyncGraphDatabase.driver(
+                uri,
+                auth=auth,
+                max_connection_pool_size=POOL_SIZE,
+                connection_acquisition_timeout=ACQ_TIMEOUT,
+                max_connection_lifetime=MAX_CONN_LIFETIME,
+                keep_alive=True,
+            )
+            _DRIVERS[key] = driver
+        return driver
+
+async def close_drivers():
+    """Closes every shared Driver. Called once, when main() finishes."""
+    with _DRIVER_LOCK:
+        drivers = list(_DRIVERS.values())
+        _DRIVERS.clear()
+    for driver in drivers:
+        await driver.close()
+        logger.info("Neo4j driver closed.")
+
+# --- Circuit Breaker ---
+# Opens after BREAKER_THRESHOLD consecutive connection failures. While open, new connect_with_retry calls fail
+# immediately and an ongoing retry loop waits out the cooldown, so each later attempt is a single half-open
+# probe; a failed probe reopens it. State is per process: a container restart starts closed.
+@dataclass
+class BreakerState:
+    fails: int = 0
+    opened_at: float = 0.0
+
+    def is_open(self):
+        return self.fails >= BREAKER_THRESHOLD
+
+    def remaining_cooldown(self):
+        if not self.is_open():
+            return 0.0
+        return max(0.0, BREAKER_COOLDOWN - (time.monotonic() - self.opened_at))
+
+    def record_failure(self):
+        self.fails += 1
+        if self.is_open():
+            self.opened_at = time.monotonic()
+
+    def record_success(self):
+        self.fails = 0
+        self.opened_at = 0.0
+
+_BREAKER = BreakerState()
 
 # --- Transaction Functions ---
 
-def clear_database(tx):
-    """0. Clears all nodes and relationships."""
-    tx.run("MATCH (n) DETACH DELETE n")
-    print("0. CLEANUP successful. Database cleared of all existing nodes and relationships.")
+async def clear_database(tx, task_ids, person_names):
+    """0. Removes the given Tasks and Persons left over from a previous run."""
+    await tx.run(_Q_DELETE_TASKS, task_ids=task_ids)
+    await tx.run(_Q_DELETE_PERSONS, person_names=person_names)
+    logger.info("0. CLEANUP successful. Removed up to %d Tasks and %d Persons from any previous run.", len(task_ids), len(person_names))
     return True
 
-def create_task(tx):
-    """1. Creates a new Task node."""
-    create_query = "CREATE (n:Task {id: 'T1', name: $name, status: 'New'}) RETURN n.name AS name"
-    result = tx.run(create_query, name="Distributed Systems Project Setup")
-    record = result.single()
-    if record:
-        print(f"1. CREATE successful. Node created: '{record['name']}'")
+async def create_task(tx, tasks):
+    """1. Creates a Task node for each {id, name} row in tasks."""
+    result = await tx.run(_Q_CREATE_TASKS, tasks=tasks)
+    summary = await result.consume()
+    if summary.counters.nodes_created == len(tasks):
+        logger.info("1. CREATE successful. Nodes created: %d", summary.counters.nodes_created)
         return True
     else:
-        raise Exception("CREATE FAILED: Node creation did not return a record.")
-
-def update_task(tx):
-    """3. Updates the Task status."""
-    update_query = "MATCH (n:Task {id: 'T1'}) SET n.status = 'In Progress', n.updatedAt = datetime() RETURN n.status AS new_status"
-    result = tx.run(update_query)
-    record = result.single()
-    if record:
-        print(f"3. UPDATE successful. New Status: {record['new_status']}")
+        raise Exception(f"CREATE FAILED: Created {summary.counters.nodes_created} of {len(tasks)} Task nodes.")
+
+async def read_task(tx, task_ids):
+    """2. Reads the given Tasks back."""
+    result = await tx.run(_Q_READ_TASKS, task_ids=task_ids)
+    records = [record async for record in result]
+    if len(records) == len(task_ids):
+        for record in records:
+            logger.debug("2. READ Task %s: %s, Status: %s", record["id"], record["name"], record["status"])
+        logger.info("2. READ successful. Tasks found: %d", len(records))
+        return records
+    else:
+        raise Exception(f"READ FAILED: Found {len(records)} of {len(task_ids)} Tasks after creation.")
+
+async def update_task(tx, task_ids):
+    """3. Updates the status of the given Tasks."""
+    result = await tx.run(_Q_UPDATE_TASKS, task_ids=task_ids, status=TASK_STATUS)
+    summary = await result.consume()
+    # Each Task gets two properties: status and updatedAt.
+    if summary.counters.properties_set == 2 * len(task_ids):
+        logger.info("3. UPDATE successful. New Status: %s (%d properties set)", TASK_STATUS, summary.counters.properties_set)
         return True
     else:
-        raise Exception("UPDATE FAILED: Could not find node T1 for update.")
-
-def create_person_and_relationship(tx):
-    """4. Creates a Person node and the RESPONSIBLE_FOR relationship."""
-    # 4a. Create Person
-    tx.run("MERGE (p:Person {name: 'Jane Doe', role: 'Team Lead'})")
-    print("4a. EXPAND successful. Node created: 'Jane Doe'")
-
-    # 4b. Create Relationship
-    relationship_query = """
-    MATCH (p:Person {name: 'Jane Doe'}), (t:Task {id: 'T1'})
-    MERGE (p)-[:RESPONSIBLE_FOR {assigned_date: date()}]->(t)
-    """
-    tx.run(relationship_query)
-    print("4b. EXPAND successful. Relationship created: Person -> RESPONSIBLE_FOR -> Task")
-    return True
+        raise Exception(f"UPDATE FAILED: Set {summary.counters.properties_set} properties on {len(task_ids)} Tasks.")
+
+async def create_person_and_relationship(tx, assignments):
+    """4. Merges a Person and its RESPONSIBLE_FOR relationship for each {person_name, role, task_id} row."""
+    result = await tx.run(_Q_MERGE_ASSIGNMENTS, assignments=assignments)
+    record = await result.single()
+    if record and record["linked"] == len(assignments):
+        logger.info("4. EXPAND successful. Person -> RESPONSIBLE_FOR -> Task relationships in place: %d", record["linked"])
+        return True
+    else:
+        raise Exception("EXPAND FAILED: Could not find every Task to link to.")
+
+async def verify_relationship(tx, assignments):
+    """5. Verifies the Person -> RESPONSIBLE_FOR -> Task path exists for each assignment."""
+    result = await tx.run(_Q_VERIFY_RELATIONSHIPS, assignments=assignments)
+    records = [record async for record in result]
+    for record in records:
+        logger.debug("5. VERIFY found: %s is %s %s", record["Responsible"], record["Relationship"], record["Task"])
+    if len(records) == len(assignments):
+        logger.info("5. VERIFY successful. Relationships found: %d", len(records))
+    else:
+        # If this fails, the data is not in the DB, even though the write was committed.
+        logger.warning("5. VERIFY FAILED: Found %d of %d relationships in the database. Data write may have failed silently.", len(records), len(assignments))
+    return records
+
+async def do_all(tx, tasks, assignments):
+    """1-4. Runs CREATE, READ, UPDATE and EXPAND for one batch in a single transaction."""
+    task_ids = [task["id"] for task in tasks]
+    return {
+        "created": await create_task(tx, tasks),
+        "read": await read_task(tx, task_ids),
+        "updated": await update_task(tx, task_ids),
+        "expanded": await create_person_and_relationship(tx, assignments),
+    }
 
 # --- Main Logic ---
 
-def run_crud_example(driver):
-    """Executes basic CRUD operations on the Neo4j database using explicit transactions."""
-    print("--- Starting CRUD Operations ---")
+def load_tasks(path):
+    """Returns (tasks, assignments) from the JSON file at path, or the built-in example when path is unset."""
+    if not path:
+        return TASKS, ASSIGNMENTS
+    with open(path) as f:
+        data = json.load(f)
+    tasks = data.get("tasks", [])
+    assignments = data.get("assignments", [])
+    task_ids = {task["id"] for task in tasks}
+    unknown = [a["task_id"] for a in assignments if a["task_id"] not in task_ids]
+    if unknown:
+        raise ValueError(f"Assignments reference unknown Task ids: {unknown}")
+    return tasks, assignments
+
+def iter_batches(tasks, assignments, batch_size=BATCH_SIZE):
+    """Yields (tasks, assignments) chunks of up to batch_size tasks, each with the assignments for its tasks."""
+    by_task = {}
+    for assignment in assignments:
+        by_task.setdefault(assignment["task_id"], []).append(assignment)
+    for i in range(0, len(tasks), batch_size):
+        task_batch = tasks[i:i + batch_size]
+        yield task_batch, [a for task in task_batch for a in by_task.get(task["id"], [])]
+
+async def create_constraints(driver):
+    """Creates the unique constraints so Task/Person lookups are index seeks. Safe to run on every boot."""
+    try:
+        async with driver.session(database=DATABASE) as session:
+            # Schema changes run as auto-commit queries; they cannot share a transaction with data writes.
+            result = await session.run(_Q_CONSTRAINT_TASK_ID)
+            await result.consume()
+            result = await session.run(_Q_CONSTRAINT_PERSON_NAME)
+            await result.consume()
+
+    except Exception as e:
+        # e.g. existing duplicate Task.id / Person.name values prevent the constraint from being created
+        logger.error("Failed to create schema constraints: %s", e)
+        sys.exit(1)
+
+    logger.info("Constraints ready: Task(id) and Person(name) are unique.")
+
+async def run_crud_example(driver, tasks, assignments):
+    """Executes basic CRUD operations on the Neo4j database using explicit transactions, one per batch of tasks."""
+    logger.info("--- Starting CRUD Operations ---")
+    batches = list(iter_batches(tasks, assignments))
     
     try:
-        with driver.session(database=DATABASE) as session:
-            
-            # Step 0: CLEANUP (MUST be execute_write)
-            session.execute_write(clear_database)
+        async with driver.session(database=DATABASE) as session:
             
-            # Step 1: CREATE (MUST be execute_write)
-            session.execute_write(create_task)
+            # Step 0: CLEANUP (MUST be execute_write). Every batch is cleared before any is written,
+            # so a Person shared between batches is not deleted after being linked.
+            for task_batch, assignment_batch in batches:
+                person_names = sorted({a["person_name"] for a in assignment_batch})
+                await session.execute_write(clear_database, [task["id"] for task in task_batch], person_names)
             
-            # Step 2: READ (Uses session.run for reading)
-            read_query = "MATCH (n:Task {id: 'T1'}) RETURN n.name AS name, n.status AS status"
-            result = session.run(read_query)
-            record = result.single()
-            if record:
-                print(f"2. READ successful. Task: {record['name']}, Status: {record['status']}")
-            else:
-                raise Exception("READ FAILED: Could not find node T1 after creation.")
-            
-            # Step 3: UPDATE (MUST be execute_write)
-            session.execute_write(update_task)
-            
-            # Step 4: EXPAND (MUST be execute_write)
-            session.execute_write(create_person_and_relationship)
-
-            # NOTE: We can remove the time.sleep(1) now that we're using explicit writes.
-
-            # Step 5: VERIFY (Uses session.run for reading)
-            verify_query = """
-            MATCH (p:Person {name: 'Jane Doe'})-[r:RESPONSIBLE_FOR]->(t:Task {id: 'T1'})
-            RETURN p.name AS Responsible, t.name AS Task, type(r) AS Relationship
-            """
-            result = session.run(verify_query)
-            record = result.single()
-            
-            if record:
-                print(f"5. VERIFY successful. Relationship found: {record['Responsible']} is {record['Relationship']} {record['Task']}")
-            else:
-                # If this fails, the data is not in the DB, even though the write was committed.
-                print("5. VERIFY FAILED: Relationship was not found in the database. Data write may have failed silently.")
+            # Steps 1-4: CREATE, READ, UPDATE, EXPAND (one execute_write, one commit per batch)
+            for task_batch, assignment_batch in batches:
+                await session.execute_write(do_all, task_batch, assignment_batch)
+
+            # Step 5: VERIFY (execute_read, so it can be routed to a reader and is retried on transient errors)
+            for _, assignment_batch in batches:
+                await session.execute_read(verify_relationship, assignment_batch)
 
             # Step 6: PERSISTENCE CHECK
-            print("6. PERSISTENCE CHECK: The graph structure is now saved to the database for inspection.")
+            logger.info("6. PERSISTENCE CHECK: The graph structure is now saved to the database for inspection.")
 
     except Exception as e:
-        print(f"An error occurred during Neo4j interaction: {e}")
+        logger.error("An error occurred during Neo4j interaction: %s", e)
         # Exit with error code so the container shows failure
         sys.exit(1)
     
-    print("--- CRUD Operations Complete ---")
+    logger.info("--- CRUD Operations Complete ---")
 
 # Function to connect with a retry mechanism
-def connect_with_retry(uri, auth, max_retries=120, delay_seconds=5):
-    """Initializes the Neo4j Driver, retrying on connection failure."""
+async def connect_with_retry(uri, auth, database=DATABASE, max_retries=10, base_delay=1.0, max_delay=30.0, jitter=0.5):
+    """Returns the shared Neo4j Driver, retrying with exponential backoff and jitter on connection failure."""
+    # With the defaults all max_retries attempts run: backoff covers the first ~20s, then the breaker cooldown
+    # spaces the remaining probes ~30-45s apart, about 3 minutes in total for a cold Neo4j start.
+    if _BREAKER.remaining_cooldown() > 0:
+        raise ServiceUnavailable(f"Circuit breaker open after {_BREAKER.fails} failed attempts; not connecting to {uri}.")
+
+    driver = get_driver(uri, auth)
+    # A database that is still starting raises TransientError (e.g. DatabaseUnavailable) rather than
+    # ServiceUnavailable, so those are retried too. Auth and other client errors fail fast.
     for attempt in range(max_retries):
         try:
-            driver = GraphDatabase.driver(uri, auth=auth)
-            # Verify connectivity using a quick transaction
-            driver.verify_connectivity()
-            print(f"Neo4j database connection established successfully at {uri}!")
+            # Verify connectivity using a quick query pinned to the target database
+            async with driver.session(database=database) as session:
+                result = await session.run(_Q_PING)
+                await result.consume()
+            _BREAKER.record_success()
+            logger.info("Neo4j database connection established successfully at %s!", uri)
             return driver
-        except ServiceUnavailable as e:
-            print(f"Connection attempt {attempt + 1}/{max_retries} failed. Retrying in {delay_seconds}s...")
+        except (ServiceUnavailable, SessionExpired, TransientError) as e:
+            _BREAKER.record_failure()
+            delay = min(max_delay, base_delay * (2 ** attempt)) * (1 + random.uniform(0, jitter))
+            # While the breaker is open, the next attempt is the half-open probe after the cooldown.
+            delay = max(delay, _BREAKER.remaining_cooldown())
             if attempt < max_retries - 1:
-                time.sleep(delay_seconds)
+                logger.warning("Connection attempt %d/%d failed. Retrying in %.1fs...", attempt + 1, max_retries, delay)
+                await asyncio.sleep(delay)
             else:
+                logger.error("Connection attempt %d/%d failed. Giving up.", attempt + 1, max_retries)
                 raise
         except Exception as e:
             raise e
     return None
 
-# Main execution block
-if __name__ == "__main__":
-    driver = None
+async def main():
+    """Connects, runs the CRUD example and closes the shared driver once at the end."""
     try:
-        driver = connect_with_retry(URI, auth=(USER, PASSWORD))
+        tasks, assignments = load_tasks(TASKS_FILE)
+    except (OSError, ValueError, KeyError) as e:
+        logger.error("Failed to load tasks from %s: %s", TASKS_FILE, e)
+        sys.exit(1)
+
+    try:
+        driver = await connect_with_retry(URI, auth=(USER, PASSWORD))
         
         if driver:
-            run_crud_example(driver)
+            await create_constraints(driver)
+            await run_crud_example(driver, tasks, assignments)
 
     except Exception as e:
-        print(f"Failed to connect to Neo4j after multiple retries. Error: {e}")
+        logger.error("Failed to connect to Neo4j after multiple retries. Error: %s", e)
         sys.exit(1)
-        
+
     finally:
-        if driver:
-            driver.close()
-            print("Neo4j driver closed.")
+        await close_drivers()
+
+# Main execution block
+if __name__ == "__main__":
+    listener = setup_logging()
+    try:
+        asyncio.run(main())
+    finally:
+        # Flushes any queued records before the process exits.
+        listener.stop()